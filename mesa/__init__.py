@@ -13,7 +13,7 @@ import mesa.time as time
 import mesa.space as space
 import mesa.flat.visualization as visualization
 from mesa.datacollection import DataCollector
-from mesa.batchrunner import batch_run  # noqa
+from mesa.batchrunner import batch_run, batch_run_to_dataframe  # noqa
 
 __all__ = [
     "Model",
@@ -23,6 +23,7 @@ __all__ = [
     "visualization",
     "DataCollector",
     "batch_run",
+    "batch_run_to_dataframe",
 ]
 
 __title__ = "mesa"
@@ -5,11 +5,21 @@ Batchrunner
 A single class to manage a batch run or parameter sweep of a given model.
 
 """
-import copy
+import gc
 import itertools
+import multiprocessing
+import operator
+import pickle
 import random
-from collections import OrderedDict
-from functools import partial
+import sys
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
+from functools import reduce
 from itertools import count, product
 from multiprocessing import Pool, cpu_count
 from warnings import warn
@@ -22,16 +32,43 @@ from typing import (
     List,
     Mapping,
     Optional,
+    Sequence,
     Tuple,
     Type,
     Union,
 )
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
 from mesa.model import Model
 
+# Run settings of the current worker process, set once by `_worker_init` so
+# that tasks only need to carry their model kwargs.
+_worker_model_cls: Optional[Type[Model]] = None
+_worker_max_steps: int = 1000
+_worker_data_collection_period: int = -1
+
+# Number of runs after which a worker process explicitly collects garbage, as
+# models typically hold reference cycles between the model and its agents.
+_WORKER_GC_INTERVAL = 100
+_worker_runs_since_gc = 0
+
+# Copy of the BatchRunnerMP a worker process serves, used to collect reporter
+# outputs on the worker side.
+_worker_batch_runner: Optional["BatchRunnerMP"] = None
+
+# Worker pool of the most recent multiprocess `batch_run` with
+# ``reuse_workers=True``, keyed by model class, number of processes and run
+# settings, so that repeated sweeps reuse warm workers.
+_executor_cache: Dict[Tuple[Any, ...], ProcessPoolExecutor] = {}
+
+
+def _default_filter(_: Mapping[str, Any]) -> bool:
+    """Default `parameter_filter` of `batch_run`, accepting every combination."""
+    return True
+
 
 def batch_run(
     model_cls: Type[Model],
@@ -44,8 +81,11 @@ def batch_run(
     data_collection_period: int = -1,
     max_steps: int = 1000,
     display_progress: bool = True,
-    parameter_filter: Callable[Mapping[str, Any], bool] = lambda _: True,
-) -> List[Dict[str, Any]]:
+    parameter_filter: Callable[Mapping[str, Any], bool] = _default_filter,
+    filter_expr: Optional[Callable[[Mapping[str, Any]], np.ndarray]] = None,
+    chunksize: Optional[int] = None,
+    reuse_workers: bool = False,
+) -> Dict[str, Any]:
     """Batch run a mesa model with a set of parameter values.
 
     Parameters
@@ -64,11 +104,43 @@ def batch_run(
         Maximum number of model steps after which the model halts, by default 1000
     display_progress : bool, optional
         Display batch run process, by default True
+    parameter_filter : Callable[Mapping[str, Any], bool], optional
+        Predicate deciding whether the model is run with a given set of
+        kwargs, by default all combinations are run
+    filter_expr : Callable[[Mapping[str, Any]], np.ndarray], optional
+        Vectorized alternative to `parameter_filter`, called once with a
+        mapping of parameter names to arrays holding the values of every
+        combination and returning a boolean mask, for example
+        ``lambda p: p["a"] < p["b"]``, by default None
+    chunksize : int, optional
+        Number of runs sent to a worker process at once, by default None
+        (spread the runs over roughly four chunks per process). Set this to 1
+        for long-running models.
+    reuse_workers : bool, optional
+        Keep the worker processes alive after the batch run and reuse them in
+        later calls with the same model class, number of processes and run
+        settings, by default False. Reused workers keep the state of the parent
+        process from when they were started: changes made since then to module
+        globals or class attributes are not seen by them. Call
+        `shutdown_workers` to stop the workers.
+
+    Notes
+    -----
+    If `model_cls` defines a ``prepare_shared()`` class method, it is called
+    once before any model is run. Use it to build large read-only class
+    attributes, such as lookup tables or networks, that all runs share. On
+    Linux the worker processes are forked afterwards and share these
+    attributes copy-on-write; on other platforms every worker calls
+    ``prepare_shared()`` once when it starts.
 
     Returns
     -------
-    List[Dict[str, Any]]
-        [description]
+    Dict[str, Any]
+        The constant parameters and, for each permutation of the variable
+        parameters, the model and agent column names together with an array
+        holding the collected data of each iteration. The data of a run is a
+        list of (step, model_row, agents) tuples of numpy arrays; use
+        `batch_run_to_dataframe` to turn them into DataFrames.
     """
 
     iterable_parameters = dict(iterable_parameters)
@@ -82,92 +154,397 @@ def batch_run(
             except TypeError:
                 constant_parameters[k] = v
 
-    kwargs_list = list(enumerate(_make_model_kwargs(constant_parameters, iterable_parameters, parameter_filter)))
-    run_list = [
-            (d[0], { "RunId" : i, **d[1] }) for i, d in enumerate(kwargs_list * iterations)
-    ]
-
-    process_func = partial(
-        _model_run_func,
-        model_cls,
-        max_steps=max_steps,
-        data_collection_period=data_collection_period,
+    # Skip calling the default filter for every combination
+    if parameter_filter is _default_filter:
+        parameter_filter = None
+    kwargs_list = _make_model_kwargs(
+        constant_parameters, iterable_parameters, parameter_filter, filter_expr
+    )
+    n_kwargs = len(kwargs_list)
+    # Runs are generated lazily rather than materializing every (iteration,
+    # permutation) pair up front.
+    run_list = (
+        (run_id % n_kwargs, run_id, kwargs_list[run_id % n_kwargs])
+        for run_id in range(n_kwargs * iterations)
     )
 
-    total_iterations = len(run_list)
-
-    kwargs_var = []
-    for _, kwargs in kwargs_list:
-        kwargs_var.append({
-            k: kwargs[k] for k in iterable_parameters.keys()
-        })
-
-    results: List[Any] = {
-            "Constant Parameters" : constant_parameters,
-            "Permutations" : [{ "Variable Parameters" : kwargs, "Runs" : [] } for kwargs in kwargs_var]
+    total_iterations = n_kwargs * iterations
+
+    if isinstance(kwargs_list, _KwargsProduct):
+        # Build the variable kwargs straight from the value indices, instead
+        # of building every full kwargs dict an extra time.
+        kwargs_var = kwargs_list.variable_kwargs()
+    else:
+        kwargs_var = [
+            {k: kwargs[k] for k in iterable_parameters} for kwargs in kwargs_list
+        ]
+
+    # Each permutation gets a pre-allocated buffer with one slot per iteration,
+    # so that storing a finished run is a single assignment.
+    results: Dict[str, Any] = {
+        "Constant Parameters": constant_parameters,
+        "Permutations": [
+            {
+                "Variable Parameters": kwargs,
+                "Model Columns": None,
+                "Agent Columns": None,
+                "Runs": np.empty(iterations, dtype=object),
+            }
+            for kwargs in kwargs_var
+        ],
     }
 
+    # Build the shared state of the model class once, before any worker starts
+    if hasattr(model_cls, "prepare_shared"):
+        model_cls.prepare_shared()
+
+    executor = None
+    if number_processes != 1:
+        number_processes = number_processes or cpu_count()
+        if chunksize is None:
+            chunksize = max(1, total_iterations // (number_processes * 4))
+        executor_args = (
+            model_cls,
+            number_processes,
+            max_steps,
+            data_collection_period,
+        )
+        # The pool is started before the progress bar, whose monitor thread
+        # would make forking the workers unsafe.
+        if reuse_workers:
+            executor = _get_executor(*executor_args)
+        else:
+            executor = _new_executor(*executor_args)
+
     with tqdm(total=total_iterations, disable=not display_progress) as pbar:
-        def _fn(kwargsId, rawdata):
-            results["Permutations"][kwargsId]["Runs"].append(rawdata)
+
+        def _fn(kwargsId, run_id, columns, rawdata):
+            permutation = results["Permutations"][kwargsId]
+            if permutation["Model Columns"] is None:
+                permutation["Model Columns"], permutation["Agent Columns"] = columns
+            permutation["Runs"][run_id // n_kwargs] = rawdata
             pbar.update()
 
-        if number_processes == 1:
-            for kwargsId, kwargs in run_list:
-                _, rawdata = process_func((kwargsId, kwargs))
-                _fn(kwargsId, rawdata)
+        if executor is None:
+            for run in run_list:
+                _fn(*_model_run_func(model_cls, run, max_steps, data_collection_period))
         else:
-            with Pool(number_processes) as p:
-                for kwargsId, rawdata in p.imap_unordered(process_func, run_list):
-                    _fn(kwargsId, rawdata)
+            try:
+                for chunk in _imap_chunks(
+                    executor, _run_chunk, run_list, chunksize, 2 * number_processes
+                ):
+                    for result in chunk:
+                        _fn(*result)
+            except BaseException:
+                # Chunks that were already running would keep a reused pool
+                # busy, so a failed run never leaves its pool behind.
+                if reuse_workers:
+                    shutdown_workers()
+                else:
+                    executor.shutdown(wait=False)
+                raise
+            if not reuse_workers:
+                executor.shutdown()
+
+    return results
+
+
+def batch_run_to_dataframe(
+    results: Mapping[str, Any]
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Convert the results of `batch_run` into model and agent DataFrames.
+
+    Parameters
+    ----------
+    results : Mapping[str, Any]
+        The return value of `batch_run`
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, pd.DataFrame]
+        The model data, with one row per run and collected step, and the agent
+        data, with one row per run, collected step and agent. Rows start with
+        the RunId, the iteration, the variable parameters and the Step,
+        followed by the "Model Columns" or "Agent Columns" of the run. The
+        constant parameters are not repeated in every row; they are available
+        as ``results["Constant Parameters"]``.
+    """
+    permutations = results["Permutations"]
+    n_kwargs = len(permutations)
+    model_rows: List[Tuple[Any, ...]] = []
+    agent_rows: List[Tuple[Any, ...]] = []
+    model_columns: List[str] = []
+    agent_columns: List[str] = []
+    for kwargs_id, permutation in enumerate(permutations):
+        params = permutation["Variable Parameters"]
+        if permutation["Model Columns"] is not None and not model_columns:
+            index_columns = ["RunId", "iteration", *params, "Step"]
+            model_columns = index_columns + list(permutation["Model Columns"])
+            agent_columns = index_columns + list(permutation["Agent Columns"])
+        for iteration, run in enumerate(permutation["Runs"]):
+            if run is None:
+                continue
+            prefix = (iteration * n_kwargs + kwargs_id, iteration, *params.values())
+            for step, model_row, agents in run:
+                row_prefix = prefix + (step,)
+                model_rows.append(row_prefix + tuple(model_row))
+                agent_rows.extend(row_prefix + tuple(agent) for agent in agents)
+
+    model_df = pd.DataFrame.from_records(model_rows, columns=model_columns)
+    agent_df = pd.DataFrame.from_records(agent_rows, columns=agent_columns)
+    return model_df, agent_df
+
+
+def _worker_init(
+    model_cls: Type[Model],
+    max_steps: int,
+    data_collection_period: int,
+    prepare_shared: bool = False,
+) -> None:
+    """Store the model class and run settings in a worker process.
+
+    If `prepare_shared` is set, the worker also builds the shared state of the
+    model class, see `batch_run`.
+    """
+    global _worker_model_cls, _worker_max_steps, _worker_data_collection_period
+    _worker_model_cls = model_cls
+    _worker_max_steps = max_steps
+    _worker_data_collection_period = data_collection_period
+    if prepare_shared and hasattr(model_cls, "prepare_shared"):
+        model_cls.prepare_shared()
+
 
+def _mp_context() -> multiprocessing.context.BaseContext:
+    """Return the multiprocessing context used for batch_run workers.
+
+    Workers are forked where that is safe, so that they share the memory of the
+    parent process copy-on-write, unless another start method has been set.
+    """
+    if sys.platform.startswith("linux") and multiprocessing.get_start_method(
+        allow_none=True
+    ) in (None, "fork"):
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def _get_executor(
+    model_cls: Type[Model],
+    number_processes: int,
+    max_steps: int,
+    data_collection_period: int,
+) -> ProcessPoolExecutor:
+    """Return a worker pool initialized with `model_cls` and the run settings.
+
+    The pool is cached and reused by subsequent calls with the same arguments.
+    Only a single pool is kept alive; a pool for different arguments replaces
+    it.
+    """
+    key = (model_cls, number_processes, max_steps, data_collection_period)
+    executor = _executor_cache.get(key)
+    if executor is None:
+        shutdown_workers()
+        executor = _new_executor(*key)
+        _executor_cache[key] = executor
+    return executor
+
+
+def _new_executor(
+    model_cls: Type[Model],
+    number_processes: int,
+    max_steps: int,
+    data_collection_period: int,
+) -> ProcessPoolExecutor:
+    """Start a worker pool initialized with `model_cls` and the run settings."""
+    context = _mp_context()
+    # Forked workers inherit the shared state built in the parent, others
+    # have to build it themselves.
+    forked = context.get_start_method() == "fork"
+    executor = ProcessPoolExecutor(
+        max_workers=number_processes,
+        mp_context=context,
+        initializer=_worker_init,
+        initargs=(model_cls, max_steps, data_collection_period, not forked),
+    )
+    # Workers are otherwise started on the first submit; start them now, before
+    # the caller starts any threads of its own.
+    executor.submit(int).result()
+    return executor
+
+
+def shutdown_workers() -> None:
+    """Stop the worker processes kept alive by ``batch_run(reuse_workers=True)``."""
+    for executor in _executor_cache.values():
+        executor.shutdown(wait=False)
+    _executor_cache.clear()
+
+
+def _imap_chunks(
+    executor: ProcessPoolExecutor,
+    func: Callable[[List[Any]], Any],
+    iterable: Iterable[Any],
+    chunksize: int,
+    max_pending: int,
+) -> Iterable[Any]:
+    """Lazily submit chunks of `iterable` to `executor`.
+
+    At most `max_pending` chunks are in flight at once. The result of each
+    chunk is yielded as soon as it is available, in completion order. Chunks
+    that have not started yet are cancelled if iteration stops early, e.g.
+    because a chunk raised.
+    """
+    iterator = iter(iterable)
+    chunks = iter(lambda: list(itertools.islice(iterator, chunksize)), [])
+    pending: "set[Future]" = set()
+    try:
+        for chunk in chunks:
+            pending.add(executor.submit(func, chunk))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            future = next(as_completed(pending))
+            pending.remove(future)
+            yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _run_chunk(runs: List[Tuple[int, int, Dict[str, Any]]]) -> List[Tuple[Any, ...]]:
+    """Run a chunk of runs with the model class and settings of the worker process."""
+    global _worker_runs_since_gc
+    results = []
+    for run in runs:
+        results.append(
+            _model_run_func(
+                _worker_model_cls,
+                run,
+                _worker_max_steps,
+                _worker_data_collection_period,
+            )
+        )
+        _worker_runs_since_gc += 1
+        if _worker_runs_since_gc >= _WORKER_GC_INTERVAL:
+            gc.collect()
+            _worker_runs_since_gc = 0
     return results
 
+
 def _make_model_kwargs(
     constant_parameters: Mapping[str, Any],
     iterable_parameters: Mapping[str, Iterable[Any]],
-    parameter_filter: Callable[Mapping[str, Any], bool],
-) -> List[Dict[str, Any]]:
+    parameter_filter: Optional[Callable[Mapping[str, Any], bool]] = None,
+    filter_expr: Optional[Callable[[Mapping[str, Any]], np.ndarray]] = None,
+) -> Sequence[Dict[str, Any]]:
     """Create model kwargs from parameters dictionary.
 
+    The combinations are enumerated as a matrix of value indices, so that
+    kwargs dicts are only built for the combinations that are actually used.
+
     Parameters
     ----------
-    parameters : Mapping[str, Union[Any, Iterable[Any]]]
-        Single or multiple values for each model parameter name
+    constant_parameters : Mapping[str, Any]
+        Single value for each constant model parameter name
+    iterable_parameters : Mapping[str, Iterable[Any]]
+        Multiple values for each variable model parameter name
+    parameter_filter : Callable[Mapping[str, Any], bool], optional
+        Predicate called with the kwargs of each combination, by default None
+    filter_expr : Callable[[Mapping[str, Any]], np.ndarray], optional
+        Vectorized predicate called once with a mapping of parameter names to
+        arrays of the values of all combinations (constant parameters map to
+        their single value), returning a boolean mask, by default None
 
     Returns
     -------
-    List[Dict[str, Any]]
-        A list of all kwargs combinations.
+    Sequence[Dict[str, Any]]
+        A sequence of all kwargs combinations.
+    """
+    names = tuple(iterable_parameters)
+    values = tuple(list(v) for v in iterable_parameters.values())
+
+    shape = tuple(len(v) for v in values)
+    if shape:
+        indices = np.indices(shape).reshape(len(shape), -1).T
+    else:
+        indices = np.zeros((1, 0), dtype=np.intp)
+
+    if filter_expr is not None:
+        columns: Dict[str, Any] = dict(constant_parameters)
+        for i, (name, v) in enumerate(zip(names, values)):
+            column = np.asarray(v)
+            # Only keep numpy's dtype for numeric and bool values; other
+            # values, such as mixed lists that numpy would turn into strings,
+            # are compared as the original objects.
+            if column.ndim != 1 or column.dtype.kind not in "biufc":
+                column = np.empty(len(v), dtype=object)
+                column[:] = v
+            columns[name] = column[indices[:, i]]
+        indices = indices[np.asarray(filter_expr(columns), dtype=bool)]
+
+    kwargs_list = _KwargsProduct(constant_parameters, names, values, indices)
+    if parameter_filter is None:
+        return kwargs_list
+    return [kwargs for kwargs in kwargs_list if parameter_filter(kwargs)]
+
+
+class _KwargsProduct(Sequence):
+    """Lazy sequence of kwargs combinations.
+
+    Each row of `indices` selects one value per variable parameter; the
+    corresponding kwargs dict is only built when the row is accessed.
     """
-    parameter_list = [ [i] for i in constant_parameters.items() ]
 
-    for param, values in iterable_parameters.items():
-        parameter_list.append([(param, v) for v in values])
+    def __init__(
+        self,
+        constant_parameters: Mapping[str, Any],
+        names: Tuple[str, ...],
+        values: Tuple[List[Any], ...],
+        indices: np.ndarray,
+    ):
+        self._constant_parameters = dict(constant_parameters)
+        self._names = names
+        self._values = values
+        self._indices = indices
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        kwargs = self._constant_parameters.copy()
+        kwargs.update(
+            zip(self._names, map(list.__getitem__, self._values, self._indices[i]))
+        )
+        return kwargs
 
-    all_kwargs = itertools.product(*parameter_list)
-    kwargs_list = []
-    for kwargs in all_kwargs:
-        d = dict(kwargs)
-        if parameter_filter(d):
-            kwargs_list.append(d)
+    def variable_kwargs(self) -> List[Dict[str, Any]]:
+        """Return the variable parameters of every combination, in order."""
+        names, values = self._names, self._values
+        return [
+            dict(zip(names, map(list.__getitem__, values, row)))
+            for row in self._indices.tolist()
+        ]
 
-    return kwargs_list
 
 def _model_run_func(
     model_cls: Type[Model],
-    kwargsPairs: Dict[str, Any],
+    run: Tuple[int, int, Dict[str, Any]],
     max_steps: int,
     data_collection_period: int,
-) -> Tuple[int, List[Dict[str, Any]]]:
+) -> Tuple[
+    int,
+    int,
+    Tuple[Tuple[str, ...], Tuple[str, ...]],
+    List[Tuple[int, np.ndarray, np.ndarray]],
+]:
     """Run a single model run and collect model and agent data.
 
     Parameters
     ----------
     model_cls : Type[Model]
         The model class to batch-run
-    kwargs : Dict[str, Any]
-        model kwargs used for this run
+    run : Tuple[int, int, Dict[str, Any]]
+        Permutation index, run id and model kwargs used for this run
     max_steps : int
         Maximum number of model steps after which the model halts, by default 1000
     data_collection_period : int
@@ -175,43 +552,54 @@ def _model_run_func(
 
     Returns
     -------
-    Tuple[Tuple[Any, ...], List[Dict[str, Any]]]
-        Return model_data, agent_data from the reporters
+    Tuple[int, int, Tuple[Tuple[str, ...], Tuple[str, ...]], List[Tuple[int, np.ndarray, np.ndarray]]]
+        Return the permutation index, the run id, the model and agent column
+        names and the collected (step, model_row, agents) tuples
     """
-    kwargsId, kwargs = kwargsPairs
-    model = model_cls(**kwargs)
+    kwargsId, run_id, kwargs = run
+    model = model_cls(RunId=run_id, **kwargs)
+    step = model.step
     while model.running and model.schedule.steps <= max_steps:
-        model.step()
+        step()
 
-    data = []
+    dc = model.datacollector
+    columns = (tuple(dc.model_vars), ("AgentID", *dc.agent_reporters))
+    data = _collect_data(model)
 
-    for step in model.datacollector.steps:
-        model_data, all_agents_data = _collect_data(model, step)
+    # The returned arrays do not reference the model, release its collected
+    # data now instead of whenever the model itself is collected.
+    dc._agent_records.clear()
+    dc.model_vars.clear()
+    del model
 
-        data.append({
-            "Step": step,
-            "ModelData": model_data,
-            "AgentsData": all_agents_data,
-        })
+    return kwargsId, run_id, columns, data
 
-    return kwargsId, data
 
-def _collect_data(
-    model: Model,
-    step: int,
-) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
-    """Collect model and agent data from a model using mesas datacollector."""
+def _collect_data(model: Model) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+    """Collect model and agent data from a model using mesas datacollector.
+
+    For every collected step, model data is returned as a one dimensional
+    array ordered like ``dc.model_vars`` and agent data as a two dimensional
+    array with one row per agent, holding the agent id followed by the agent
+    reporters.
+    """
     dc = model.datacollector
+    # The reporter schema is the same for every step of a run.
+    model_vars = tuple(dc.model_vars.values())
+    n_agent_cols = 2 + len(dc.agent_reporters)
 
-    model_data = {param: values[step] for param, values in dc.model_vars.items()}
+    data = []
+    for step in dc.steps:
+        model_data = np.empty(len(model_vars), dtype=object)
+        for i, values in enumerate(model_vars):
+            model_data[i] = values[step]
 
-    all_agents_data = []
-    raw_agent_data = dc._agent_records[step]
-    for data in raw_agent_data:
-        agent_dict = {"AgentID": data[1]}
-        agent_dict.update(zip(dc.agent_reporters, data[2:]))
-        all_agents_data.append(agent_dict)
-    return model_data, all_agents_data
+        # Agent records are (step, agent_id, *reports); drop the step column.
+        agents_data = np.asarray(dc._agent_records[step], dtype=object).reshape(
+            -1, n_agent_cols
+        )[:, 1:]
+        data.append((step, model_data, agents_data))
+    return data
 
 
 class ParameterError(TypeError):
@@ -256,6 +644,7 @@ class FixedBatchRunner:
         model_reporters=None,
         agent_reporters=None,
         display_progress=True,
+        result_sink=None,
     ):
         """Create a new BatchRunner for a given model with the given
         parameters.
@@ -286,6 +675,11 @@ class FixedBatchRunner:
                 collected at the level of each agent present in the model at
                 the end of the run.
             display_progress: Display progress bar with time estimation?
+            result_sink: Optional function called with the run key and the
+                model and agent DataFrames of each run's DataCollector (None
+                if not collected), e.g. to write them to disk. If given, the
+                DataFrames are handed to it instead of being kept in memory,
+                and get_collector_model/get_collector_agents stay empty.
 
         """
         self.model_cls = model_cls
@@ -297,8 +691,9 @@ class FixedBatchRunner:
         self.iterations = iterations
         self.max_steps = max_steps
 
-        for params in self.parameters_list:
-            if list(params) != list(self.parameters_list[0]):
+        if self.parameters_list:
+            first_names = tuple(self.parameters_list[0])
+            if any(tuple(params) != first_names for params in self.parameters_list):
                 msg = "parameter names in parameters_list are not equal across the list"
                 raise ValueError(msg)
 
@@ -310,12 +705,18 @@ class FixedBatchRunner:
 
         if self.agent_reporters:
             self.agent_vars = {}
+            self._agent_names = tuple(self.agent_reporters.keys())
+            # Fetches the agent id along with the reporters, which also makes
+            # it always return a tuple.
+            self._agent_getter = operator.attrgetter(
+                "unique_id", *self.agent_reporters.values()
+            )
 
-        # Make Compatible with Python 3.5
-        self.datacollector_model_reporters = OrderedDict()
-        self.datacollector_agent_reporters = OrderedDict()
+        self.datacollector_model_reporters = {}
+        self.datacollector_agent_reporters = {}
 
         self.display_progress = display_progress
+        self.result_sink = result_sink
 
     def _make_model_args(self):
         """Prepare all combinations of parameter values for `run_all`
@@ -375,14 +776,12 @@ class FixedBatchRunner:
                 self.agent_vars[agent_key] = reports
         # Collects data from datacollector object in model
         if results is not None:
+            collector_model = collector_agents = None
             if results.model_reporters is not None:
-                self.datacollector_model_reporters[
-                    model_key
-                ] = results.get_model_vars_dataframe()
+                collector_model = results.get_model_vars_dataframe()
             if results.agent_reporters is not None:
-                self.datacollector_agent_reporters[
-                    model_key
-                ] = results.get_agent_vars_dataframe()
+                collector_agents = results.get_agent_vars_dataframe()
+            self._store_collector_frames(model_key, collector_model, collector_agents)
 
         return (
             getattr(self, "model_vars", None),
@@ -391,6 +790,17 @@ class FixedBatchRunner:
             getattr(self, "datacollector_agent_reporters", None),
         )
 
+    def _store_collector_frames(self, model_key, collector_model, collector_agents):
+        """Keep the DataCollector DataFrames of a run, or pass them to the
+        result sink."""
+        if self.result_sink is not None:
+            self.result_sink(model_key, collector_model, collector_agents)
+            return
+        if collector_model is not None:
+            self.datacollector_model_reporters[model_key] = collector_model
+        if collector_agents is not None:
+            self.datacollector_agent_reporters[model_key] = collector_agents
+
     def run_model(self, model):
         """Run a model object to completion, or until reaching max steps.
 
@@ -398,8 +808,11 @@ class FixedBatchRunner:
         in your subclass.
 
         """
-        while model.running and model.schedule.steps < self.max_steps:
-            model.step()
+        # Bind the per-run invariants to locals, this loop runs once per step.
+        # model.schedule is looked up each step since a model may replace it.
+        step, max_steps = model.step, self.max_steps
+        while model.running and model.schedule.steps < max_steps:
+            step()
 
         if hasattr(model, "datacollector"):
             return model.datacollector
@@ -408,20 +821,14 @@ class FixedBatchRunner:
 
     def collect_model_vars(self, model):
         """Run reporters and collect model-level variables."""
-        model_vars = OrderedDict()
-        for var, reporter in self.model_reporters.items():
-            model_vars[var] = reporter(model)
-
-        return model_vars
+        return {var: reporter(model) for var, reporter in self.model_reporters.items()}
 
     def collect_agent_vars(self, model):
         """Run reporters and collect agent-level variables."""
-        agent_vars = OrderedDict()
-        for agent in model.schedule._agents.values():
-            agent_record = OrderedDict()
-            for var, reporter in self.agent_reporters.items():
-                agent_record[var] = getattr(agent, reporter)
-            agent_vars[agent.unique_id] = agent_record
+        names = self._agent_names
+        agent_vars = {}
+        for vals in map(self._agent_getter, model.schedule._agents.values()):
+            agent_vars[vals[0]] = dict(zip(names, vals[1:]))
         return agent_vars
 
     def get_model_vars_dataframe(self):
@@ -464,47 +871,58 @@ class FixedBatchRunner:
             index_cols = list(self.parameters_list[0].keys())
         index_cols += extra_cols
 
-        records = []
-        for param_key, values in vars_dict.items():
-            record = dict(zip(index_cols, param_key))
-            record.update(values)
-            records.append(record)
+        rest_cols = {col for values in vars_dict.values() for col in values}
+        reporter_cols = sorted(rest_cols - set(index_cols))
 
-        df = pd.DataFrame(records)
-        rest_cols = set(df.columns) - set(index_cols)
-        ordered = df[index_cols + list(sorted(rest_cols))]
+        # Build plain tuple rows and let pandas parse them, rather than a dict
+        # per record.
+        n_index = len(index_cols)
+        rows = [
+            param_key[:n_index] + tuple(map(values.get, reporter_cols))
+            for param_key, values in vars_dict.items()
+        ]
+
+        ordered = pd.DataFrame.from_records(rows, columns=index_cols + reporter_cols)
         ordered.sort_values(by="Run", inplace=True)
         if self._include_fixed:
-            for param in self.fixed_parameters.keys():
-                val = self.fixed_parameters[param]
-
+            for param, val in self.fixed_parameters.items():
                 # avoid error when val is an iterable
-                vallist = [val for i in range(ordered.shape[0])]
-                ordered[param] = vallist
+                if pd.api.types.is_list_like(val):
+                    val = [val] * ordered.shape[0]
+                ordered[param] = val
         return ordered
 
 
 class ParameterProduct:
     def __init__(self, variable_parameters):
-        self.param_names, self.param_lists = zip(
-            *(copy.deepcopy(variable_parameters)).items()
-        )
-        self._product = product(*self.param_lists)
+        self.param_names = tuple(variable_parameters)
+        self.param_lists = tuple(tuple(v) for v in variable_parameters.values())
+        # Created on first use, so that the object can be pickled until then
+        self._product = None
 
     def __iter__(self):
         return self
 
     def __next__(self):
+        if self._product is None:
+            self._product = product(*self.param_lists)
         return dict(zip(self.param_names, next(self._product)))
 
+    def __getstate__(self):
+        # itertools.product cannot be pickled; an unpickled copy starts over.
+        state = self.__dict__.copy()
+        state["_product"] = None
+        return state
+
 
 # Roughly inspired by sklearn.model_selection.ParameterSampler.  Does not handle
 # distributions, only lists.
 class ParameterSampler:
     def __init__(self, parameter_lists, n, random_state=None):
-        self.param_names, self.param_lists = zip(
-            *(copy.deepcopy(parameter_lists)).items()
-        )
+        self.param_names = tuple(parameter_lists)
+        self.param_lists = tuple(tuple(v) for v in parameter_lists.values())
+        self._lens = tuple(len(p_list) for p_list in self.param_lists)
+        self._n_combinations = reduce(operator.mul, self._lens, 1)
         self.n = n
         if random_state is None:
             self.random_state = random.Random()
@@ -520,13 +938,45 @@ class ParameterSampler:
     def __next__(self):
         self.count += 1
         if self.count <= self.n:
+            return self._draw()
+        raise StopIteration()
+
+    def _draw(self):
+        if not isinstance(self.random_state, random.Random):
+            # Other generators, e.g. numpy's, only promise a choice() method
             return dict(
                 zip(
                     self.param_names,
                     [self.random_state.choice(p_list) for p_list in self.param_lists],
                 )
             )
-        raise StopIteration()
+        # Draw one index into the whole product of the parameter lists and
+        # decompose it, instead of drawing once per parameter.
+        index = self.random_state.randrange(self._n_combinations)
+        values = []
+        for p_list, length in zip(self.param_lists, self._lens):
+            index, i = divmod(index, length)
+            values.append(p_list[i])
+        return dict(zip(self.param_names, values))
+
+    def sample_batch(self, k):
+        """Draw up to `k` of the remaining samples at once.
+
+        With a `random.Random` state, the value indices of all samples are
+        drawn with a single call to a numpy generator seeded from it; other
+        random states draw the samples one by one.
+        """
+        k = max(0, min(k, self.n - self.count))
+        self.count += k
+        if not isinstance(self.random_state, random.Random):
+            return [self._draw() for _ in range(k)]
+        rng = np.random.default_rng(self.random_state.getrandbits(64))
+        indices = rng.integers(self._lens, size=(k, len(self._lens)))
+        columns = [
+            [p_list[i] for i in column]
+            for p_list, column in zip(self.param_lists, indices.T)
+        ]
+        return [dict(zip(self.param_names, values)) for values in zip(*columns)]
 
 
 class BatchRunner(FixedBatchRunner):
@@ -553,6 +1003,7 @@ class BatchRunner(FixedBatchRunner):
         model_reporters=None,
         agent_reporters=None,
         display_progress=True,
+        result_sink=None,
     ):
         """Create a new BatchRunner for a given model with the given
         parameters.
@@ -583,6 +1034,11 @@ class BatchRunner(FixedBatchRunner):
                 collected at the level of each agent present in the model at
                 the end of the run.
             display_progress: Display progress bar with time estimation?
+            result_sink: Optional function called with the run key and the
+                model and agent DataFrames of each run's DataCollector (None
+                if not collected), e.g. to write them to disk. If given, the
+                DataFrames are handed to it instead of being kept in memory,
+                and get_collector_model/get_collector_agents stay empty.
 
         """
         warn(
@@ -600,6 +1056,7 @@ class BatchRunner(FixedBatchRunner):
                 model_reporters,
                 agent_reporters,
                 display_progress,
+                result_sink,
             )
         else:
             super().__init__(
@@ -611,6 +1068,7 @@ class BatchRunner(FixedBatchRunner):
                 model_reporters,
                 agent_reporters,
                 display_progress,
+                result_sink,
             )
 
 
@@ -618,7 +1076,7 @@ class BatchRunnerMP(BatchRunner):  # pragma: no cover
     """DEPRECATION WARNING: BatchRunner class has been replaced by batch_run
     Child class of BatchRunner, extended with multiprocessing support."""
 
-    def __init__(self, model_cls, nr_processes=None, **kwargs):
+    def __init__(self, model_cls, nr_processes=None, keep_models=False, **kwargs):
         """Create a new BatchRunnerMP for a given model with the given
         parameters.
 
@@ -626,7 +1084,15 @@ class BatchRunnerMP(BatchRunner):  # pragma: no cover
         nr_processes: int
                       the number of separate processes the BatchRunner
                       should start, all running in parallel.
+        keep_models: bool
+                      whether to keep every finished model object in
+                      `self.models`. By default a model is discarded as soon
+                      as its results have been collected.
         kwargs: the kwargs required for the parent BatchRunner class
+
+        If no run collected DataCollector data, get_collector_model and
+        get_collector_agents return None. With a result_sink they return
+        empty dicts, like BatchRunner does.
         """
         warn(
             "BatchRunnerMP class has been replaced by batch_run function. Please see documentation.",
@@ -642,14 +1108,30 @@ class BatchRunnerMP(BatchRunner):  # pragma: no cover
             self.processes = nr_processes
 
         super().__init__(model_cls, **kwargs)
-        self.pool = Pool(self.processes)
+        self.keep_models = keep_models
+        if self.keep_models:
+            self.models = {}
+        # Reporters run in the workers whenever this runner can be sent to
+        # them, so that workers return reporter outputs instead of models.
+        self._reports_in_workers = not self.keep_models and _is_worker_shareable(self)
+        self.pool = Pool(
+            self.processes,
+            initializer=_init_batch_runner_worker,
+            initargs=(
+                self.model_cls,
+                self.max_steps,
+                self if self._reports_in_workers else None,
+            ),
+        )
 
     def _make_model_args_mp(self):
         """Prepare all combinations of parameter values for `run_all`
         Due to multiprocessing requirements of @StaticMethod takes different input, hence the similar function
+        The model class and max_steps are passed to the worker processes once,
+        when the pool starts, so they are not part of every task.
         Returns:
-            List of list with the form:
-            [[model_object, dictionary_of_kwargs, max_steps, iterations]]
+            Tuple of a generator of tuples with the form
+            (dictionary_of_kwargs, iteration), and the total number of runs
         """
         total_iterations = self.iterations
         all_kwargs = []
@@ -659,12 +1141,7 @@ class BatchRunnerMP(BatchRunner):  # pragma: no cover
             for params in self.parameters_list:
                 kwargs = params.copy()
                 kwargs.update(self.fixed_parameters)
-                # run each iterations specific number of times
-                for iter in range(self.iterations):
-                    kwargs_repeated = kwargs.copy()
-                    all_kwargs.append(
-                        [self.model_cls, kwargs_repeated, self.max_steps, iter]
-                    )
+                all_kwargs.append(kwargs)
 
         elif len(self.fixed_parameters):
             count = 1
@@ -673,7 +1150,15 @@ class BatchRunnerMP(BatchRunner):  # pragma: no cover
 
         total_iterations *= count
 
-        return all_kwargs, total_iterations
+        # run each iterations specific number of times, generating the runs
+        # lazily instead of holding every (kwargs, iteration) pair at once
+        run_iter_args = (
+            (kwargs, iteration)
+            for kwargs in all_kwargs
+            for iteration in range(self.iterations)
+        )
+
+        return run_iter_args, total_iterations
 
     @staticmethod
     def _run_wrappermp(iter_args):
@@ -681,60 +1166,98 @@ class BatchRunnerMP(BatchRunner):  # pragma: no cover
         Based on requirement of Python multiprocessing requires @staticmethod decorator;
         this is primarily to ensure functionality on Windows OS and does not impact MAC or Linux distros
 
-        :param iter_args: List of arguments for model run
-            iter_args[0] = model object
-            iter_args[1] = key word arguments needed for model object
-            iter_args[2] = maximum number of steps for model
-            iter_args[3] = number of time to run model for stochastic/random variation with same parameters
+        The model class and maximum number of steps are those the worker
+        process was initialized with.
+
+        :param iter_args: Tuple of arguments for model run
+            iter_args[0] = key word arguments needed for model object
+            iter_args[1] = number of time to run model for stochastic/random variation with same parameters
         :return:
             tuple of param values which serves as a unique key for model results
             model object
         """
+        kwargs, iteration = iter_args
+        return BatchRunnerMP._run_modelmp(
+            _worker_model_cls, _worker_max_steps, kwargs, iteration
+        )
 
-        model_i = iter_args[0]
-        kwargs = iter_args[1]
-        max_steps = iter_args[2]
-        iteration = iter_args[3]
+    @staticmethod
+    def _run_modelmp(model_cls, max_steps, kwargs, iteration):
+        """
+        Run a single model to completion, or until reaching max steps
 
+        :return:
+            tuple of param values which serves as a unique key for model results
+            model object
+        """
         # instantiate version of model with correct parameters
-        model = model_i(**kwargs)
+        model = model_cls(**kwargs)
+        step = model.step
         while model.running and model.schedule.steps < max_steps:
-            model.step()
-
-        # add iteration number to dictionary to make unique_key
-        kwargs["iteration"] = iteration
+            step()
 
-        # convert kwargs dict to tuple to  make consistent
-        param_values = tuple(kwargs.values())
+        # add iteration number to the param values to make unique_key
+        param_values = tuple(kwargs.values()) + (iteration,)
 
         return param_values, model
 
-    def _result_prep_mp(self, results):
+    @staticmethod
+    def _run_reportsmp(iter_args):
+        """
+        Like `_run_wrappermp`, but collect the reporter outputs in the worker
+        process and return those instead of the (much larger) model object
+
+        :param iter_args: List of arguments for model run, see `_run_wrappermp`
+        :return:
+            tuple of param values which serves as a unique key for model results
+            tuple of the model's reporter outputs, see `_model_reports`
         """
-        Helper Function
-        :param results: Takes results dictionary from Processpool and single processor debug run and fixes format to
-        make compatible with BatchRunner Output
-        :updates model_vars and agents_vars so consistent across all batchrunner
+        param_values, model = BatchRunnerMP._run_wrappermp(iter_args)
+        return param_values, _worker_batch_runner._model_reports(model)
+
+    def _collect_model_results(self, model_key, model):
+        """
+        Collect the reporter outputs of a single finished model into
+        model_vars, agent_vars and the datacollector dictionaries
         """
-        # Take results and convert to dictionary so dataframe can be called
-        for model_key, model in results.items():
-            if self.model_reporters:
-                self.model_vars[model_key] = self.collect_model_vars(model)
-            if self.agent_reporters:
-                agent_vars = self.collect_agent_vars(model)
-                for agent_id, reports in agent_vars.items():
-                    agent_key = model_key + (agent_id,)
-                    self.agent_vars[agent_key] = reports
-            if hasattr(model, "datacollector"):
-                if model.datacollector.model_reporters is not None:
-                    self.datacollector_model_reporters[
-                        model_key
-                    ] = model.datacollector.get_model_vars_dataframe()
-                if model.datacollector.agent_reporters is not None:
-                    self.datacollector_agent_reporters[
-                        model_key
-                    ] = model.datacollector.get_agent_vars_dataframe()
+        self._store_model_reports(model_key, self._model_reports(model))
+        if self.keep_models:
+            self.models[model_key] = model
 
+    def _model_reports(self, model):
+        """
+        Run the reporters on a finished model
+        :return:
+            tuple of model-level variables, agent-level variables and the
+            model and agent dataframes of the model's datacollector, each None
+            if not collected
+        """
+        model_vars = self.collect_model_vars(model) if self.model_reporters else None
+        agent_vars = self.collect_agent_vars(model) if self.agent_reporters else None
+        collector_model = collector_agents = None
+        if hasattr(model, "datacollector"):
+            if model.datacollector.model_reporters is not None:
+                collector_model = model.datacollector.get_model_vars_dataframe()
+            if model.datacollector.agent_reporters is not None:
+                collector_agents = model.datacollector.get_agent_vars_dataframe()
+        return model_vars, agent_vars, collector_model, collector_agents
+
+    def _store_model_reports(self, model_key, reports):
+        """Store the reporter outputs returned by `_model_reports`."""
+        model_vars, agent_vars, collector_model, collector_agents = reports
+        if model_vars is not None:
+            self.model_vars[model_key] = model_vars
+        if agent_vars is not None:
+            for agent_id, agent_reports in agent_vars.items():
+                agent_key = model_key + (agent_id,)
+                self.agent_vars[agent_key] = agent_reports
+        if collector_model is not None or collector_agents is not None:
+            self._store_collector_frames(model_key, collector_model, collector_agents)
+
+    def _finalize_results(self):
+        # With a result sink the collector dicts stay empty, as in BatchRunner
+        if self.result_sink is not None:
+            return
         # Make results consistent
         if len(self.datacollector_model_reporters.keys()) == 0:
             self.datacollector_model_reporters = None
@@ -748,26 +1271,34 @@ class BatchRunnerMP(BatchRunner):  # pragma: no cover
         """
 
         run_iter_args, total_iterations = self._make_model_args_mp()
-        # register the process pool and init a queue
-        # store results in ordered dictionary
-        results = {}
 
+        # Results are collected as soon as each run finishes, so that only
+        # the models currently in flight are held in memory.
         if self.processes > 1:
             with tqdm(total_iterations, disable=not self.display_progress) as pbar:
-                for params, model in self.pool.imap_unordered(
-                    self._run_wrappermp, run_iter_args
-                ):
-                    results[params] = model
-                    pbar.update()
-
-                self._result_prep_mp(results)
+                if not self._reports_in_workers:
+                    for params, model in self.pool.imap_unordered(
+                        self._run_wrappermp, run_iter_args
+                    ):
+                        self._collect_model_results(params, model)
+                        pbar.update()
+                else:
+                    # Workers only send back the reporter outputs
+                    for params, reports in self.pool.imap_unordered(
+                        self._run_reportsmp, run_iter_args
+                    ):
+                        self._store_model_reports(params, reports)
+                        pbar.update()
         # For debugging model due to difficulty of getting errors during multiprocessing
         else:
-            for run in run_iter_args:
-                params, model_data = self._run_wrappermp(run)
-                results[params] = model_data
+            for kwargs, iteration in run_iter_args:
+                params, model = self._run_modelmp(
+                    self.model_cls, self.max_steps, kwargs, iteration
+                )
+                self._collect_model_results(params, model)
+                del model
 
-            self._result_prep_mp(results)
+        self._finalize_results()
 
         # Close multi-processing
         self.pool.close()
@@ -778,3 +1309,25 @@ class BatchRunnerMP(BatchRunner):  # pragma: no cover
             getattr(self, "datacollector_model_reporters", None),
             getattr(self, "datacollector_agent_reporters", None),
         )
+
+
+def _init_batch_runner_worker(model_cls, max_steps, batch_runner):
+    """Store the model class, max_steps and the BatchRunnerMP served by a
+    worker process."""
+    global _worker_batch_runner
+    _worker_init(model_cls, max_steps, -1)
+    _worker_batch_runner = batch_runner
+
+
+def _is_worker_shareable(obj):
+    """Check whether `obj` can be passed to new worker processes.
+
+    Forked workers inherit it as is, other start methods need to pickle it.
+    """
+    if multiprocessing.get_start_method() == "fork":
+        return True
+    try:
+        pickle.dumps(obj)
+    except Exception:
+        return False
+    return True
@@ -43,7 +43,7 @@ step position, which is then sent back to the client via the websocket.
 
 The websocket protocol is as follows:
 Each message is a JSON object, with a "type" property which defines the rest of
-the structure.
+the structure. Server messages are sent as UTF-8 encoded binary frames.
 
 Server -> Client:
     Send over the model state to visualize.
@@ -60,6 +60,13 @@ Server -> Client:
             "Shape Count: 1"]
     }
 
+    Several consecutive model states may be coalesced into a single message,
+    whose data is a list of model states in step order.
+    {
+    "type": "viz_state_batch",
+    "data": [<model state>, <model state>, ...]
+    }
+
     Informs the client that the model is over.
     {"type": "end"}
 
@@ -96,14 +103,19 @@ Client -> Server:
 
 """
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from itertools import chain
+import json
 import os
 import platform
+import sys
 import tornado.autoreload
 import tornado.ioloop
 import tornado.web
 import tornado.websocket
-import tornado.escape
 import tornado.gen
+from tornado.log import app_log
 import webbrowser
 
 from mesa.visualization.UserParam import UserSettableParameter, UserParam
@@ -116,14 +128,87 @@ from mesa.visualization.UserParam import UserSettableParameter, UserParam
 if platform.system() == "Windows" and platform.python_version_tuple() >= ("3", "7"):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 D3_JS_FILE = "external/d3-7.4.3.min.js"
 CHART_JS_FILE = "external/chart-3.6.1.min.js"
 
 
+if orjson is not None:
+    # Element states may be keyed by ints (e.g. CanvasGrid layers) and hold
+    # numpy values
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def _json_dumps(obj):
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+
+    _json_loads = orjson.loads
+
+else:
+
+    def _json_dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+
+    _json_loads = json.loads
+
+# The end message never changes, so it is encoded once
+END_FRAME = _json_dumps({"type": "end"})
+
+# Queued in place of a viz_state message while a client is behind, and
+# rendered from the model's latest state once it is written
+_LATEST_VIZ_STATE = object()
+
+
+class _EncodedVizState:
+    """The data of a viz_state message, encoded when it was rendered."""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+
+def _user_param(val):
+    """Return the user parameter held by `val`, or None if it holds none."""
+    if not val.is_const():
+        return None
+    param = val()
+    # UserSettableParameter is not a UserParam subclass, so both are checked
+    if isinstance(param, (UserSettableParameter, UserParam)):
+        return param
+    return None
+
+
 def is_user_param(val):
-    return val.is_const() and (isinstance(val(), UserSettableParameter) or issubclass(
-        val().__class__, UserParam
-    ))
+    return _user_param(val) is not None
+
+
+@lru_cache(maxsize=None)
+def _split_includes(package_includes, local_includes):
+    """Partition an element's includes into JavaScript and CSS files.
+
+    Args:
+        package_includes: Tuple of the element's package include files.
+        local_includes: Tuple of the element's local include files.
+
+    Returns:
+        A (package_js, package_css, local_js, local_css) tuple of
+        deduplicated file name tuples in declaration order.
+
+    """
+    split = []
+    for includes in (package_includes, local_includes):
+        scripts, stylesheets = [], []
+        for include_file in dict.fromkeys(includes):
+            if ModularServer._is_stylesheet(include_file):
+                stylesheets.append(include_file)
+            else:
+                scripts.append(include_file)
+        split += [tuple(scripts), tuple(stylesheets)]
+    return tuple(split)
 
 
 class VisualizationElement:
@@ -151,6 +236,14 @@ class VisualizationElement:
     def __init__(self):
         pass
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # The same include files are declared by many element classes; interned
+        # names make deduplicating them across elements cheaper.
+        for attr in ("package_includes", "local_includes"):
+            if attr in cls.__dict__:
+                setattr(cls, attr, [sys.intern(f) for f in cls.__dict__[attr]])
+
     def render(self, model):
         """Build visualization data from a model object.
 
@@ -173,6 +266,19 @@ class TextElement(VisualizationElement):
     js_code = "elements.push(new TextModule());"
 
 
+class _CallableTextElement(TextElement):
+    """
+    TextElement rendering the text returned by a function of the model.
+    """
+
+    def __init__(self, fn):
+        super().__init__()
+        self.fn = fn
+
+    def render(self, model):
+        return self.fn(model)
+
+
 # =============================================================================
 # Actual Tornado code starts here:
 
@@ -181,70 +287,191 @@ class PageHandler(tornado.web.RequestHandler):
     """Handler for the HTML template which holds the visualization."""
 
     def get(self):
-        elements = self.application.visualization_elements
-        for i, element in enumerate(elements):
-            element.index = i
         self.render(
             "modular_template.html",
             port=self.application.port,
             model_name=self.application.model_name,
             description=self.application.description,
-            package_js_includes=self.application.package_js_includes,
-            package_css_includes=self.application.package_css_includes,
-            local_js_includes=self.application.local_js_includes,
-            local_css_includes=self.application.local_css_includes,
+            package_js_includes=list(self.application.package_js_includes),
+            package_css_includes=list(self.application.package_css_includes),
+            local_js_includes=list(self.application.local_js_includes),
+            local_css_includes=list(self.application.local_css_includes),
             scripts=self.application.js_code,
         )
 
 
 class SocketHandler(tornado.websocket.WebSocketHandler):
-    """Handler for websocket."""
+    """Handler for websocket.
+
+    Outgoing messages are queued and sent by a writer coroutine, which
+    coalesces consecutive viz_state messages into one viz_state_batch message.
+    """
+
+    # Maximum number of messages drained from the queue per write
+    max_batch_size = 128
 
     def open(self):
         if self.application.verbose:
             print("Socket opened!")
-        self.write_message(
-            {"type": "model_params", "params": self.application.user_params}
-        )
+        self._outbox = asyncio.Queue()
+        self._queued_states = 0
+        self._latest_queued = False
+        self._writer = asyncio.ensure_future(self._write_messages())
+        self._dispatch = {
+            "get_step": self._handle_step,
+            "reset": self._handle_reset,
+            "submit_params": self._handle_submit,
+        }
+        self.send(self.application.model_params_frame)
+
+    def on_close(self):
+        self._writer.cancel()
+
+    def send(self, message):
+        """Queue a message to be written to the client.
+
+        The message is either a JSON-ready dict or an already encoded frame.
+        """
+        self._outbox.put_nowait(message)
+
+    async def send_viz_state(self):
+        """Render the model and queue its state.
+
+        If the server's max_unsent is set and that many states are already
+        waiting to be written, the state is not rendered now; the client gets
+        the latest state once the writer catches up instead.
+        """
+        max_unsent = self.application.max_unsent
+        self._queued_states += 1
+        if max_unsent is None or self._queued_states <= max_unsent:
+            try:
+                message = await self._viz_state_message()
+            except Exception:
+                # e.g. a state that cannot be encoded; close the connection
+                # rather than leave the client waiting for the state
+                app_log.exception("Error rendering the model state")
+                self.close()
+                return
+            self.send(message)
+        elif not self._latest_queued:
+            self._latest_queued = True
+            self.send(_LATEST_VIZ_STATE)
+        else:
+            # Covered by the latest state that is already queued
+            self._queued_states -= 1
+
+    async def _viz_state_message(self):
+        # Rendering goes through the step executor, so it never overlaps a step;
+        # the state is encoded there too, off the IOLoop
+        data = await self._run_on_model(self._encode_state)
+        return _EncodedVizState(data)
+
+    def _encode_state(self):
+        return _json_dumps(self.application.render_model())
+
+    async def _write_messages(self):
+        while True:
+            messages = [await self._outbox.get()]
+            while not self._outbox.empty() and len(messages) < self.max_batch_size:
+                messages.append(self._outbox.get_nowait())
+            # States being written no longer count as waiting
+            self._queued_states -= sum(
+                message is _LATEST_VIZ_STATE or isinstance(message, _EncodedVizState)
+                for message in messages
+            )
+            try:
+                if self._latest_queued and _LATEST_VIZ_STATE in messages:
+                    self._latest_queued = False
+                    latest = await self._viz_state_message()
+                    messages = [
+                        latest if message is _LATEST_VIZ_STATE else message
+                        for message in messages
+                    ]
+                for message in self._coalesce_viz_states(messages):
+                    # Encoded bytes are framed by Tornado as is, without another
+                    # encoding pass or copy into an intermediate str
+                    if not isinstance(message, bytes):
+                        message = _json_dumps(message)
+                    await self.write_message(message, binary=True)
+            except tornado.websocket.WebSocketClosedError:
+                return
+            except Exception:
+                # e.g. a state that cannot be encoded; without a writer the
+                # client would wait forever, so drop the connection instead
+                app_log.exception("Error writing to websocket")
+                self.close()
+                return
+
+    @staticmethod
+    def _coalesce_viz_states(messages):
+        """Merge runs of consecutive viz_state messages, keeping the order of
+        all messages."""
+        states = []
+        for message in messages:
+            if isinstance(message, _EncodedVizState):
+                states.append(message.data)
+                continue
+            if states:
+                yield SocketHandler._viz_state_batch(states)
+                states = []
+            yield message
+        if states:
+            yield SocketHandler._viz_state_batch(states)
+
+    @staticmethod
+    def _viz_state_batch(states):
+        # The states are already encoded, so the message is joined around them
+        if len(states) == 1:
+            return b'{"type":"viz_state","data":' + states[0] + b"}"
+        return b'{"type":"viz_state_batch","data":[' + b",".join(states) + b"]}"
 
     def check_origin(self, origin):
         return True
 
-    @property
-    def viz_state_message(self):
-        return {"type": "viz_state", "data": self.application.render_model()}
+    def get_compression_options(self):
+        # Enables permessage-deflate for clients that support it; viz states
+        # are repetitive JSON and compress well.
+        if not self.application.compression:
+            return None
+        return {"compression_level": 6, "mem_level": 8}
+
+    def _run_on_model(self, fn):
+        return tornado.ioloop.IOLoop.current().run_in_executor(
+            self.application.step_executor, fn
+        )
 
-    def on_message(self, message):
-        """Receiving a message from the websocket, parse, and act accordingly."""
+    async def on_message(self, message):
+        """Receiving a message from the websocket, parse, and act accordingly.
+
+        Model steps and resets run on the server's step executor, so they do not
+        block the IOLoop.
+        """
         if self.application.verbose:
             print(message)
-        msg = tornado.escape.json_decode(message)
-
-        if msg["type"] == "get_step":
-            if not self.application.model.running:
-                self.write_message({"type": "end"})
-            else:
-                self.application.model.step()
-                self.write_message(self.viz_state_message)
+        msg = _json_loads(message)
+        handler = self._dispatch.get(msg["type"], self._handle_unknown)
+        await handler(msg)
 
-        elif msg["type"] == "reset":
-            self.application.reset_model()
-            self.write_message(self.viz_state_message)
+    async def _handle_step(self, msg):
+        if not self.application.model.running:
+            self.send(END_FRAME)
+        else:
+            await self._run_on_model(self.application.step_model)
+            await self.send_viz_state()
 
-        elif msg["type"] == "submit_params":
-            param = msg["param"]
-            value = msg["value"]
+    async def _handle_reset(self, msg):
+        await self._run_on_model(self.application.reset_model)
+        await self.send_viz_state()
 
-            # Is the param editable?
-            if param in self.application.user_params:
-                if is_user_param(self.application.model_kwargs[param]):
-                    self.application.model_kwargs[param].x.value = value
-                else:
-                    self.application.model_kwargs[param].x = value
+    async def _handle_submit(self, msg):
+        # Serialized with resets, which drop the cached user params
+        await self._run_on_model(
+            partial(self.application.submit_param, msg["param"], msg["value"])
+        )
 
-        else:
-            if self.application.verbose:
-                print("Unexpected message!")
+    async def _handle_unknown(self, msg):
+        if self.application.verbose:
+            print("Unexpected message!")
 
 
 class ModularServer(tornado.web.Application):
@@ -268,40 +495,59 @@ class ModularServer(tornado.web.Application):
     handlers = [page_handler, socket_handler, static_handler, local_handler]
 
     settings = {
-        "debug": True,
+        "debug": False,
         "autoreload": False,
         "template_path": os.path.dirname(__file__) + "/templates",
     }
 
     EXCLUDE_LIST = ("width", "height")
 
+    # Number of viz states that may wait to be written to a client before
+    # further steps are no longer rendered one by one; the client then gets
+    # only the latest state once it catches up. None (the default) sends every
+    # state. Elements that accumulate history, such as ChartModule, miss the
+    # skipped steps.
+    max_unsent = None
+
     def __init__(
-        self, model_cls, visualization_elements, name="Mesa Model", model_params=None
+        self,
+        model_cls,
+        visualization_elements,
+        name="Mesa Model",
+        model_params=None,
+        compression=True,
+        debug=False,
     ):
-        """Create a new visualization server with the given elements."""
+        """Create a new visualization server with the given elements.
+
+        Set compression to False to send websocket messages uncompressed,
+        trading bandwidth for server CPU time. Set debug to True to run Tornado
+        in debug mode (uncached templates, tracebacks in responses) and to
+        reload the server on source changes.
+        """
         if model_params is None:
             model_params = {}
+        self.compression = compression
+        self.debug = debug
         # Prep visualization elements:
         self.visualization_elements = self._auto_convert_functions_to_TextElements(
             visualization_elements
         )
-        self.package_js_includes = set()
-        self.package_css_includes = set()
-        self.local_js_includes = set()
-        self.local_css_includes = set()
-        self.js_code = []
-        for element in self.visualization_elements:
-            for include_file in element.package_includes:
-                if self._is_stylesheet(include_file):
-                    self.package_css_includes.add(include_file)
-                else:
-                    self.package_js_includes.add(include_file)
-            for include_file in element.local_includes:
-                if self._is_stylesheet(include_file):
-                    self.local_css_includes.add(include_file)
-                else:
-                    self.local_js_includes.add(include_file)
-            self.js_code.append(element.js_code)
+        for i, element in enumerate(self.visualization_elements):
+            element.index = i
+        self._render_fns = [element.render for element in self.visualization_elements]
+        # Elements of the same class share include lists, so the split is
+        # cached on their contents rather than redone for every element
+        splits = [
+            _split_includes(tuple(e.package_includes), tuple(e.local_includes))
+            for e in self.visualization_elements
+        ]
+        # Insertion-ordered dicts dedupe the includes while keeping load order
+        self.package_js_includes = dict.fromkeys(chain(*(s[0] for s in splits)))
+        self.package_css_includes = dict.fromkeys(chain(*(s[1] for s in splits)))
+        self.local_js_includes = dict.fromkeys(chain(*(s[2] for s in splits)))
+        self.local_css_includes = dict.fromkeys(chain(*(s[3] for s in splits)))
+        self.js_code = [element.js_code for element in self.visualization_elements]
 
         # Initializing the model
         self.model_name = name
@@ -313,46 +559,98 @@ class ModularServer(tornado.web.Application):
             self.description = model_cls.__doc__
 
         self.model_kwargs = model_params
+        self._user_params = None
+        self._model_params_frame = None
+        self._rendered_step = None
+        self._rendered_state = None
+        # A single worker keeps model steps and resets in order
+        self.step_executor = ThreadPoolExecutor(max_workers=1)
         self.reset_model()
 
         # Initializing the application itself:
-        super().__init__(self.handlers, **self.settings)
+        super().__init__(self.handlers, **dict(self.settings, debug=debug))
 
     @property
     def user_params(self):
-        result = {}
-        for param, val in self.model_kwargs.items():
-            if is_user_param(val):
-                result[param] = val().json
+        """JSON-ready descriptions of the user-settable model parameters.
 
-        return result
+        Built on first access and kept until the next model reset.
+        """
+        # Read and return a local: a reset on the step executor may clear the
+        # attribute while a client is being sent the parameters.
+        user_params = self._user_params
+        if user_params is None:
+            user_params = {}
+            for param, val in self.model_kwargs.items():
+                user_param = _user_param(val)
+                if user_param is not None:
+                    user_params[param] = user_param.json
+            self._user_params = user_params
+        return user_params
+
+    @property
+    def model_params_frame(self):
+        """The encoded model_params message, kept until the parameters change."""
+        frame = self._model_params_frame
+        if frame is None:
+            frame = _json_dumps({"type": "model_params", "params": self.user_params})
+            self._model_params_frame = frame
+        return frame
+
+    def submit_param(self, param, value):
+        """Update a user-settable model parameter with a value from a client."""
+        user_params = self.user_params
+        # Is the param editable?
+        if param not in user_params:
+            return
+        val = self.model_kwargs[param]
+        if is_user_param(val):
+            val.x.value = value
+        else:
+            val.x = value
+        user_params[param] = val().json
+        self._model_params_frame = None
 
     def reset_model(self):
         """Reinstantiate the model object, using the current parameters."""
-
-        model_params = {}
-        for key, val in self.model_kwargs.items():
-#            if is_user_param(val) and val().param_type == "static_text":
-#                # static_text is never used for setting params
-#                continue
-#            else:
-            model_params[key] = val
-
-        self.model = self.model_cls(**model_params)
+        self.model = self.model_cls(**self.model_kwargs)
+        self._user_params = None
+        self._model_params_frame = None
+        self._model_steps = 0
+        self._rendered_state = None
+
+    def step_model(self):
+        """Advance the model by one step."""
+        self.model.step()
+        self._model_steps += 1
+        self._rendered_state = None
 
     def render_model(self):
         """Turn the current state of the model into a dictionary of
         visualizations
 
+        The state of the current step is memoized, so rendering the same
+        step again (e.g. for another client), or the final state of a model
+        that has stopped running, does not call the elements.
+        """
+        # The schedule's step count also catches steps taken outside of
+        # step_model
+        schedule = getattr(self.model, "schedule", None)
+        step = (self._model_steps, getattr(schedule, "steps", None))
+        if self._rendered_state is None or step != self._rendered_step:
+            model = self.model
+            self._rendered_state = [render(model) for render in self._render_fns]
+            self._rendered_step = step
+        return list(self._rendered_state)
+
+    def launch(self, port=None, open_browser=True, debug=None):
+        """Run the app.
+
+        Source changes only reload the server in debug mode, which defaults to
+        the server's debug setting.
         """
-        visualization_state = []
-        for element in self.visualization_elements:
-            element_state = element.render(self.model)
-            visualization_state.append(element_state)
-        return visualization_state
-
-    def launch(self, port=None, open_browser=True):
-        """Run the app."""
+        if debug is None:
+            debug = self.debug
         if port is not None:
             self.port = port
         url = f"http://127.0.0.1:{self.port}"
@@ -360,7 +658,8 @@ class ModularServer(tornado.web.Application):
         self.listen(self.port)
         if open_browser:
             webbrowser.open(url)
-        tornado.autoreload.start()
+        if debug:
+            tornado.autoreload.start()
         tornado.ioloop.IOLoop.current().start()
 
     @staticmethod
@@ -377,12 +676,7 @@ class ModularServer(tornado.web.Application):
         if not callable(x):
             # i.e. not a function
             return x
-
-        class MyTextElement(TextElement):
-            def render(self, model):
-                return x(model)
-
-        return MyTextElement()
+        return _CallableTextElement(x)
 
     def _auto_convert_functions_to_TextElements(self, visualization_elements):
         out_elements = [
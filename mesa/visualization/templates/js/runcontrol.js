@@ -79,7 +79,17 @@ function ModelController(tick = 0, fps = 3, running = false, finished = false) {
    * @param {any[]} data Model state data passed to the visualization elements
    */
   this.render = function render(data) {
-    vizElements.forEach((element, index) => element.render(data[index]));
+    this.renderBatch([data]);
+  };
+
+  /**
+   * Render visualisation elements with several consecutive model states.
+   * @param {any[][]} batch Model state data of each step, in step order
+   */
+  this.renderBatch = function renderBatch(batch) {
+    batch.forEach((data) =>
+      vizElements.forEach((element, index) => element.render(data[index]))
+    );
     if (this.running) {
       this.timeout = setTimeout(() => this.step(), 1000 / this.fps);
     }
@@ -134,18 +144,29 @@ const ws = new WebSocket(
     location.host +
     "/ws"
 );
+// The server sends UTF-8 encoded JSON as binary frames
+ws.binaryType = "arraybuffer";
+const textDecoder = new TextDecoder();
 
 /**
  * Parse and handle an incoming message on the WebSocket connection.
- * @param {string} message - the message received from the WebSocket
+ * @param {MessageEvent} message - the message received from the WebSocket
  */
 ws.onmessage = function (message) {
-  const msg = JSON.parse(message.data);
+  const msg = JSON.parse(
+    typeof message.data === "string"
+      ? message.data
+      : textDecoder.decode(message.data)
+  );
   switch (msg["type"]) {
     case "viz_state":
       // Update visualization state
       controller.render(msg["data"]);
       break;
+    case "viz_state_batch":
+      // Update visualization state with several coalesced steps
+      controller.renderBatch(msg["data"]);
+      break;
     case "end":
       // We have reached the end of the model
       controller.done();
@@ -1,25 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import time
+
+import pytest
+
 from mesa.agent import Agent
-from mesa.batchrunner import _make_model_kwargs, batch_run
+from mesa import batchrunner
+from mesa.batchrunner import _make_model_kwargs, batch_run, batch_run_to_dataframe
 from mesa.datacollection import DataCollector
 from mesa.model import Model
 from mesa.time import BaseScheduler
 
 
 def test_make_model_kwargs():
-    assert _make_model_kwargs({"a": 3, "b": 5}) == [{"a": 3, "b": 5}]
-    assert _make_model_kwargs({"a": 3, "b": range(3)}) == [
+    assert list(_make_model_kwargs({"a": 3, "b": 5}, {})) == [{"a": 3, "b": 5}]
+    assert list(_make_model_kwargs({"a": 3}, {"b": range(3)})) == [
         {"a": 3, "b": 0},
         {"a": 3, "b": 1},
         {"a": 3, "b": 2},
     ]
-    assert _make_model_kwargs({"a": range(2), "b": range(2)}) == [
+    assert list(_make_model_kwargs({}, {"a": range(2), "b": range(2)})) == [
         {"a": 0, "b": 0},
         {"a": 0, "b": 1},
         {"a": 1, "b": 0},
         {"a": 1, "b": 1},
     ]
-    # If the value is a single string, do not iterate over it.
-    assert _make_model_kwargs({"a": "value"}) == [{"a": "value"}]
+    assert list(_make_model_kwargs({}, {"a": range(2), "b": []})) == []
+
+
+def test_make_model_kwargs_filters():
+    parameters = {"a": range(3), "b": range(3)}
+    expected = [{"a": 0, "b": 1}, {"a": 0, "b": 2}, {"a": 1, "b": 2}]
+    assert (
+        list(_make_model_kwargs({}, parameters, lambda d: d["a"] < d["b"])) == expected
+    )
+    assert (
+        list(_make_model_kwargs({}, parameters, filter_expr=lambda p: p["a"] < p["b"]))
+        == expected
+    )
+    # Mixed values are not coerced to strings
+    assert list(
+        _make_model_kwargs({}, {"a": [1, "x"]}, filter_expr=lambda p: p["a"] == 1)
+    ) == [{"a": 1}]
 
 
 class MockAgent(Agent):
@@ -87,35 +109,62 @@ class MockModel(Model):
 
 def test_batch_run():
     result = batch_run(MockModel, {}, number_processes=2)
-    assert result == [
-        {
-            "RunId": 0,
-            "iteration": 0,
-            "Step": 1000,
-            "reported_model_param": 42,
-            "AgentID": 0,
-            "agent_id": 0,
-            "agent_local": 250.0,
-        },
-        {
-            "RunId": 0,
-            "iteration": 0,
-            "Step": 1000,
-            "reported_model_param": 42,
-            "AgentID": 1,
-            "agent_id": 1,
-            "agent_local": 250.0,
-        },
-        {
-            "RunId": 0,
-            "iteration": 0,
-            "Step": 1000,
-            "reported_model_param": 42,
-            "AgentID": 2,
-            "agent_id": 2,
-            "agent_local": 250.0,
-        },
+    assert result["Constant Parameters"] == {}
+    assert len(result["Permutations"]) == 1
+    permutation = result["Permutations"][0]
+    assert permutation["Variable Parameters"] == {}
+    assert permutation["Model Columns"] == ("reported_model_param",)
+    assert permutation["Agent Columns"] == ("AgentID", "agent_id", "agent_local")
+    assert len(permutation["Runs"]) == 1
+
+    step, model_data, agents_data = permutation["Runs"][0][-1]
+    assert step == 1000
+    assert list(model_data) == [42]
+    assert agents_data.tolist() == [
+        [0, 0, 250.0],
+        [1, 1, 250.0],
+        [2, 2, 250.0],
+    ]
+
+
+def test_batch_run_to_dataframe():
+    result = batch_run(
+        MockModel,
+        {"variable_model_param": range(2), "fixed_model_param": "F"},
+        iterations=2,
+        max_steps=3,
+        data_collection_period=1,
+    )
+    model_df, agent_df = batch_run_to_dataframe(result)
+    assert list(model_df.columns) == [
+        "RunId",
+        "iteration",
+        "variable_model_param",
+        "Step",
+        "reported_model_param",
+    ]
+    # 2 permutations x 2 iterations x 4 collected steps (0 to 3)
+    assert len(model_df) == 16
+    assert sorted(model_df["RunId"].unique()) == [0, 1, 2, 3]
+    assert set(model_df["reported_model_param"]) == {42}
+    run = model_df[model_df["RunId"] == 3]
+    assert run["variable_model_param"].tolist() == [1] * 4
+    assert run["iteration"].tolist() == [1] * 4
+    assert run["Step"].tolist() == [0, 1, 2, 3]
+
+    assert list(agent_df.columns) == [
+        "RunId",
+        "iteration",
+        "variable_model_param",
+        "Step",
+        "AgentID",
+        "agent_id",
+        "agent_local",
     ]
+    assert len(agent_df) == 16 * 3
+    last = agent_df[(agent_df["RunId"] == 0) & (agent_df["Step"] == 3)]
+    assert last["AgentID"].tolist() == [0, 1, 2]
+    assert last["agent_local"].tolist() == [0.75] * 3
 
 
 def test_batch_run_with_params():
@@ -131,17 +180,136 @@ def test_batch_run_with_params():
 
 def test_batch_run_no_agent_reporters():
     result = batch_run(MockModel, {"enable_agent_reporters": False}, number_processes=2)
-    print(result)
-    assert result == [
-        {
-            "RunId": 0,
-            "iteration": 0,
-            "Step": 1000,
-            "enable_agent_reporters": False,
-            "reported_model_param": 42,
-        }
-    ]
+    assert result["Constant Parameters"] == {"enable_agent_reporters": False}
+    permutation = result["Permutations"][0]
+    assert permutation["Agent Columns"] == ("AgentID",)
+
+    step, model_data, agents_data = permutation["Runs"][0][-1]
+    assert step == 1000
+    assert list(model_data) == [42]
+    assert agents_data.shape == (0, 1)
 
 
 def test_batch_run_single_core():
-    batch_run(MockModel, {}, number_processes=1, iterations=10)
+    result = batch_run(MockModel, {}, number_processes=1, iterations=10)
+    runs = result["Permutations"][0]["Runs"]
+    assert len(runs) == 10
+    assert all(run is not None for run in runs)
+
+
+def test_batch_run_chunksize():
+    result = batch_run(
+        MockModel,
+        {"variable_model_param": range(3)},
+        number_processes=2,
+        iterations=2,
+        max_steps=10,
+        chunksize=1,
+    )
+    assert [p["Variable Parameters"] for p in result["Permutations"]] == [
+        {"variable_model_param": 0},
+        {"variable_model_param": 1},
+        {"variable_model_param": 2},
+    ]
+    for permutation in result["Permutations"]:
+        assert all(run is not None for run in permutation["Runs"])
+
+
+def test_batch_run_reuses_worker_pool():
+    batch_run(MockModel, {}, number_processes=2, max_steps=10)
+    assert batchrunner._executor_cache == {}
+
+    batch_run(MockModel, {}, number_processes=2, max_steps=10, reuse_workers=True)
+    executor = batchrunner._executor_cache[(MockModel, 2, 10, -1)]
+    batch_run(MockModel, {}, number_processes=2, max_steps=10, reuse_workers=True)
+    assert batchrunner._executor_cache[(MockModel, 2, 10, -1)] is executor
+
+    batchrunner.shutdown_workers()
+    assert batchrunner._executor_cache == {}
+
+
+class FailingModel(MockModel):
+    """
+    Model failing on its first step
+    """
+
+    def step(self):
+        raise RuntimeError("step failed")
+
+
+def test_imap_chunks_cancels_pending_chunks():
+    started = []
+
+    def run(chunk):
+        started.append(chunk[0])
+        time.sleep(0.05)
+        return 1 / chunk[0]
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        chunks = batchrunner._imap_chunks(executor, run, [0, 1, 2, 3], 1, 4)
+        with pytest.raises(ZeroDivisionError):
+            list(chunks)
+    assert len(started) < 4
+
+
+def test_batch_run_failure_discards_pool():
+    with pytest.raises(RuntimeError):
+        batch_run(FailingModel, {}, number_processes=2, reuse_workers=True)
+    assert batchrunner._executor_cache == {}
+
+
+def test_mp_context_respects_start_method():
+    start_method = multiprocessing.get_start_method(allow_none=True)
+    multiprocessing.set_start_method("spawn", force=True)
+    try:
+        assert batchrunner._mp_context().get_start_method() == "spawn"
+    finally:
+        multiprocessing.set_start_method(start_method, force=True)
+
+
+SCALE = 1
+
+
+class GlobalScaleModel(MockModel):
+    """
+    Model reporting a module global
+    """
+
+    def get_local_model_param(self):
+        return SCALE
+
+
+def test_batch_run_sees_updated_globals():
+    global SCALE
+    try:
+        for SCALE in (1, 99):
+            result = batch_run(GlobalScaleModel, {}, number_processes=2, max_steps=10)
+            _, model_data, _ = result["Permutations"][0]["Runs"][0][-1]
+            assert list(model_data) == [SCALE]
+    finally:
+        SCALE = 1
+
+
+class SharedStateModel(MockModel):
+    """
+    Model building a shared class attribute in prepare_shared
+    """
+
+    shared_value = None
+
+    @classmethod
+    def prepare_shared(cls):
+        cls.shared_value = 42
+
+    def get_local_model_param(self):
+        return self.shared_value
+
+
+def test_batch_run_prepare_shared():
+    for number_processes in (1, 2):
+        SharedStateModel.shared_value = None
+        result = batch_run(
+            SharedStateModel, {}, number_processes=number_processes, max_steps=10
+        )
+        _, model_data, _ = result["Permutations"][0]["Runs"][0][-1]
+        assert list(model_data) == [42]
@@ -3,8 +3,11 @@ Test the BatchRunner
 """
 from functools import reduce
 from operator import mul
+import pickle
 import unittest
 
+import numpy as np
+
 from mesa import Agent, Model
 from mesa.time import BaseScheduler
 from mesa.datacollection import DataCollector
@@ -77,6 +80,15 @@ class MockModel(Model):
         self.schedule.step()
 
 
+class MockScheduleSwapModel(MockModel):
+    def step(self):
+        super().step()
+        # Replace the schedule mid-run, carrying its step count over
+        schedule = BaseScheduler(self)
+        schedule.steps = self.schedule.steps
+        self.schedule = schedule
+
+
 class MockMixedModel(Model):
     def __init__(self, **other_params):
         super().__init__()
@@ -207,6 +219,33 @@ class TestBatchRunner(unittest.TestCase):
         with self.assertRaises(KeyError):
             agent_collector[(900, "k", 3)]
 
+    def test_result_sink(self):
+        """
+        Test that datacollector results are handed to the result sink
+        instead of being kept
+        """
+        received = {}
+
+        def sink(model_key, model_df, agent_df):
+            received[model_key] = (model_df, agent_df)
+
+        batch = BatchRunner(
+            self.mock_model,
+            variable_parameters=self.variable_params,
+            iterations=self.iterations,
+            max_steps=self.max_steps,
+            model_reporters=self.model_reporters,
+            agent_reporters=self.agent_reporters,
+            result_sink=sink,
+        )
+        batch.run_all()
+        self.assertEqual(len(received), self.model_runs)
+        self.assertEqual(batch.get_collector_model(), {})
+        self.assertEqual(batch.get_collector_agents(), {})
+        model_df, agent_df = received[(0, 1, 1)]
+        self.assertIn("reported_model_param", model_df.columns)
+        self.assertIn("agent_id", agent_df.columns)
+
     def test_model_with_fixed_parameters_as_kwargs(self):
         """
         Test that model with fixed parameters passed like kwargs is
@@ -287,6 +326,18 @@ class TestBatchRunner(unittest.TestCase):
         with self.assertRaises(ValueError, msg=msg):
             self.launch_batch_processing_fixed_list()
 
+    def test_model_replacing_schedule(self):
+        batch = BatchRunner(
+            MockScheduleSwapModel,
+            fixed_parameters={"fixed_model_param": 1},
+            max_steps=self.max_steps,
+            display_progress=False,
+            model_reporters={"steps": lambda m: m.schedule.steps},
+        )
+        batch.run_all()
+        model_vars = batch.get_model_vars_dataframe()
+        self.assertEqual(list(model_vars["steps"]), [self.max_steps])
+
 
 class TestParameters(unittest.TestCase):
     def test_product(self):
@@ -305,6 +356,13 @@ class TestParameters(unittest.TestCase):
             ],
         )
 
+    def test_product_pickle(self):
+        params = ParameterProduct({"var_alpha": ["a", "b"], "var_num": range(2)})
+        next(params)
+        restored = pickle.loads(pickle.dumps(params))
+        self.assertEqual(len(list(restored)), 4)
+        self.assertEqual(len(list(params)), 3)
+
     def test_sampler(self):
         params1 = ParameterSampler(
             {
@@ -324,6 +382,33 @@ class TestParameters(unittest.TestCase):
         self.assertEqual(10, len(lp))
         self.assertEqual(lp, list(params2))
 
+    def test_sampler_batch(self):
+        params = ParameterSampler(
+            {"var_alpha": ["a", "b", "c"], "var_num": range(16)},
+            n=10,
+            random_state=1,
+        )
+        batch = params.sample_batch(4)
+        self.assertEqual(4, len(batch))
+        for sample in batch:
+            self.assertIn(sample["var_alpha"], ["a", "b", "c"])
+            self.assertIn(sample["var_num"], range(16))
+        # The rest of the samples can still be drawn one by one
+        self.assertEqual(6, len(list(params)))
+        self.assertEqual([], params.sample_batch(4))
+
+    def test_sampler_numpy_random_state(self):
+        params = ParameterSampler(
+            {"var_alpha": ["a", "b", "c"], "var_num": range(16)},
+            n=10,
+            random_state=np.random.RandomState(0),
+        )
+        samples = params.sample_batch(4) + list(params)
+        self.assertEqual(10, len(samples))
+        for sample in samples:
+            self.assertIn(sample["var_alpha"], ["a", "b", "c"])
+            self.assertIn(sample["var_num"], range(16))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,4 +1,5 @@
-from tornado.testing import AsyncHTTPTestCase
+from tornado.log import app_log
+from tornado.testing import AsyncHTTPTestCase, ExpectLog
 import tornado
 from mesa import Model
 from mesa.visualization.ModularVisualization import ModularServer
@@ -37,3 +38,118 @@ class TestServer(AsyncHTTPTestCase):
         ws_client.write_message("Unknown message!")
         response = yield ws_client.read_message()
         assert response is None
+
+    @tornado.testing.gen_test
+    def test_websocket_compression(self):
+        ws_url = "ws://localhost:" + str(self.get_http_port()) + "/ws"
+        ws_client = yield tornado.websocket.websocket_connect(
+            ws_url, compression_options={}
+        )
+        assert "permessage-deflate" in ws_client.headers.get(
+            "Sec-WebSocket-Extensions", ""
+        )
+
+        response = yield ws_client.read_message()
+        msg = json.loads(response)
+        assert msg["type"] == "model_params"
+
+
+class CountingModel(Model):
+    def __init__(self):
+        super().__init__()
+        self.steps = 0
+
+    def step(self):
+        self.steps += 1
+
+
+class TestServerSteps(AsyncHTTPTestCase):
+    def get_app(self):
+        app = ModularServer(CountingModel, [lambda model: model.steps])
+        app.verbose = False
+        return app
+
+    @tornado.testing.gen_test
+    def test_websocket_every_step_in_order(self):
+        ws_url = "ws://localhost:" + str(self.get_http_port()) + "/ws"
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        yield ws_client.read_message()
+
+        for _ in range(20):
+            ws_client.write_message('{"type": "get_step"}')
+        states = []
+        while len(states) < 20:
+            msg = json.loads((yield ws_client.read_message()))
+            if msg["type"] == "viz_state_batch":
+                states.extend(msg["data"])
+            else:
+                assert msg["type"] == "viz_state"
+                states.append(msg["data"])
+        assert states == [[step] for step in range(1, 21)]
+
+
+class TestServerDropToLatest(AsyncHTTPTestCase):
+    def get_app(self):
+        app = ModularServer(CountingModel, [lambda model: model.steps])
+        app.verbose = False
+        # Every state counts as behind, so only the latest state is rendered
+        app.max_unsent = 0
+        return app
+
+    @tornado.testing.gen_test
+    def test_websocket_sends_latest_state(self):
+        ws_url = "ws://localhost:" + str(self.get_http_port()) + "/ws"
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        yield ws_client.read_message()
+
+        ws_client.write_message('{"type": "get_step"}')
+        msg = json.loads((yield ws_client.read_message()))
+        assert msg == {"type": "viz_state", "data": [1]}
+
+        for _ in range(5):
+            ws_client.write_message('{"type": "get_step"}')
+        states = []
+        while states[-1:] != [[6]]:
+            msg = json.loads((yield ws_client.read_message()))
+            assert msg["type"] == "viz_state"
+            states.append(msg["data"])
+        assert states == sorted(states)
+        assert len(states) <= 5
+
+
+class TestServerEncodeError(AsyncHTTPTestCase):
+    def get_app(self):
+        # A set cannot be encoded as JSON
+        app = ModularServer(Model, [lambda model: {1, 2}])
+        app.verbose = False
+        return app
+
+    @tornado.testing.gen_test
+    def test_websocket_closes_on_encode_error(self):
+        ws_url = "ws://localhost:" + str(self.get_http_port()) + "/ws"
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        yield ws_client.read_message()
+
+        with ExpectLog(app_log, "Error rendering the model state"):
+            ws_client.write_message('{"type": "get_step"}')
+            response = yield ws_client.read_message()
+        assert response is None
+
+
+class TestServerEncodeErrorLatest(TestServerEncodeError):
+    def get_app(self):
+        app = super().get_app()
+        # States are rendered by the writer, which closes the connection too
+        app.max_unsent = 0
+        return app
+
+    @tornado.testing.gen_test
+    def test_websocket_closes_on_encode_error(self):
+        ws_url = "ws://localhost:" + str(self.get_http_port()) + "/ws"
+        ws_client = yield tornado.websocket.websocket_connect(ws_url)
+        yield ws_client.read_message()
+
+        with ExpectLog(app_log, "Error writing to websocket"):
+            ws_client.write_message('{"type": "get_step"}')
+            response = yield ws_client.read_message()
+        assert response is None
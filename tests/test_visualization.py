@@ -4,7 +4,13 @@ from collections import defaultdict
 from mesa.model import Model
 from mesa.space import Grid
 from mesa.time import SimultaneousActivation
-from mesa.visualization.ModularVisualization import ModularServer
+from mesa.visualization.ModularVisualization import (
+    ModularServer,
+    SocketHandler,
+    VisualizationElement,
+    _EncodedVizState,
+    _split_includes,
+)
 from mesa.visualization.modules import CanvasGrid, TextElement
 from mesa.visualization.UserParam import UserSettableParameter
 
@@ -80,6 +86,71 @@ class TestModularServer(TestCase):
         state = self.server.render_model()
         assert state[1] == "<b>VisualizationElement goes here</b>."
 
+    def test_render_model_cache(self):
+        state = self.server.render_model()
+        assert self.server.render_model()[0] is state[0]
+
+        self.server.step_model()
+        assert self.server.render_model()[0] is not state[0]
+
+        # Steps taken directly on the model are noticed too
+        state = self.server.render_model()
+        self.server.model.step()
+        assert self.server.render_model()[0] is not state[0]
+
+        state = self.server.render_model()
+        self.server.reset_model()
+        assert self.server.render_model()[0] is not state[0]
+
+    def test_split_includes(self):
+        class StyledElement(VisualizationElement):
+            package_includes = ["StyledModule.js", "styled.css"]
+
+        assert _split_includes(tuple(StyledElement.package_includes), ()) == (
+            ("StyledModule.js",),
+            ("styled.css",),
+            (),
+            (),
+        )
+        assert _split_includes((), ("local.CSS", "mixed.Css", "local.js")) == (
+            (),
+            (),
+            ("local.js",),
+            ("local.CSS", "mixed.Css"),
+        )
+
+        # Includes set on an instance or appended in place are picked up
+        styled = StyledElement()
+        styled.local_includes = ["instance.css"]
+        StyledElement.package_includes.append("extra.js")
+
+        # Elements need only the include attributes, not a common base class
+        class DuckElement:
+            package_includes = ["DuckModule.js"]
+            local_includes = ["duck.css"]
+            js_code = ""
+
+            def render(self, model):
+                return None
+
+        server = ModularServer(
+            MockModel,
+            self.viz_elements + [styled, DuckElement()],
+            "Test Model",
+            model_params=self.user_params,
+        )
+        assert list(server.package_js_includes) == [
+            "GridDraw.js",
+            "CanvasModule.js",
+            "InteractionHandler.js",
+            "TextModule.js",
+            "StyledModule.js",
+            "extra.js",
+            "DuckModule.js",
+        ]
+        assert list(server.package_css_includes) == ["styled.css"]
+        assert list(server.local_css_includes) == ["instance.css", "duck.css"]
+
     def test_user_params(self):
         print(self.server.user_params)
         assert self.server.user_params == {
@@ -88,3 +159,29 @@ class TestModularServer(TestCase):
                 "slider", "Test Parameter", 200, 0, 300, 10
             ).json,
         }
+
+
+class TestSocketHandler(TestCase):
+    """Test the coalescing of outgoing websocket messages"""
+
+    def test_coalesce_viz_states(self):
+        end = b'{"type":"end"}'
+        messages = [
+            _EncodedVizState(b"[1]"),
+            _EncodedVizState(b"[2]"),
+            end,
+            _EncodedVizState(b"[3]"),
+            {"type": "model_params", "params": {}},
+            _EncodedVizState(b"[4]"),
+            _EncodedVizState(b"[5]"),
+        ]
+        assert list(SocketHandler._coalesce_viz_states(messages)) == [
+            b'{"type":"viz_state_batch","data":[[1],[2]]}',
+            end,
+            b'{"type":"viz_state","data":[3]}',
+            {"type": "model_params", "params": {}},
+            b'{"type":"viz_state_batch","data":[[4],[5]]}',
+        ]
+
+    def test_coalesce_viz_states_empty(self):
+        assert list(SocketHandler._coalesce_viz_states([])) == []